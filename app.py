@@ -1,16 +1,32 @@
 import streamlit as st
 import os
-import time
-import PyPDF2
+import uuid
+import tempfile
 import json
+import re
+import math
+import zipfile
+import multiprocessing
+from datetime import timedelta
+from xml.sax.saxutils import escape as xml_escape
+from urllib.parse import quote
+import numpy as np
 import pandas as pd
 import plotly.express as px
 from io import BytesIO
-from docx import Document
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from google import genai
+from google.genai import types
+from pydantic import BaseModel
 import gspread
 from google.oauth2.service_account import Credentials
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
+from pdf_extract import extract_pdf_text, PDFIUM_LOCK
 
 st.set_page_config(page_title="RBS Knowledge Corner", layout="wide", page_icon="🏛️")
 
@@ -19,6 +35,11 @@ GOOGLE_CREDS_JSON = os.environ.get("GOOGLE_CREDENTIALS_JSON")
 SHEET_ID = os.environ.get("SPREADSHEET_ID")
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
 api_key = os.environ.get("GEMINI_API_KEY")
+LEGAL_SYSTEM_INSTRUCTION = "You are a senior litigation attorney and expert legal counsel."
+
+STATUSES = ["🟢 Good Law", "🟡 Distinguished / Caution", "🛑 Overruled / Bad Law"]
+STATUS_INDEX = {s: i for i, s in enumerate(STATUSES)}
+SEARCH_PAGE_SIZE = 25
 
 @st.cache_resource
 def get_google_clients():
@@ -38,89 +59,489 @@ def get_google_clients():
 
 sh, storage_client = get_google_clients()
 
-def init_sheets():
-    if sh:
-        try:
-            worksheet_titles = [ws.title for ws in sh.worksheets()]
-            
-            if "Judgments" not in worksheet_titles:
-                sh.add_worksheet(title="Judgments", rows="1000", cols="10")
-            judgments_sheet = sh.worksheet("Judgments")
-            if not judgments_sheet.row_values(1):
-                judgments_sheet.append_row(["ID", "Case Name", "Act Name", "Section Number", "Authority", "Brief Facts", "Decision Held", "PDF File IDs", "AI Notes", "Status"])
-                
-            if "Internal Usage" not in worksheet_titles:
-                sh.add_worksheet(title="Internal Usage", rows="1000", cols="10")
-            internal_sheet = sh.worksheet("Internal Usage")
-            if not internal_sheet.row_values(1):
-                internal_sheet.append_row(["ID", "Judgment ID", "Internal Matter Name", "Internal Notice", "Usage Notes", "AI Brief"])
-                
-            if "Notice Replies" not in worksheet_titles:
-                sh.add_worksheet(title="Notice Replies", rows="1000", cols="10")
-            notice_sheet = sh.worksheet("Notice Replies")
-            if not notice_sheet.row_values(1):
-                notice_sheet.append_row(["ID", "Matter Name", "Notice Text", "Internal Judgments Used", "External References", "Final Reply"])
-                
-        except Exception as e:
-            st.error(f"Error initializing sheets: {e}")
+@st.cache_resource
+def ensure_schema(sheet_id):
+    # Runs once per server process; a GCS sentinel lets later cold starts skip the Sheets checks too
+    sentinel = storage_client.bucket(GCS_BUCKET_NAME).blob(f"_meta/sheets_initialized_{sheet_id}")
+    try:
+        if sentinel.exists():
+            return True
+    except Exception:
+        pass
+    worksheet_titles = [ws.title for ws in sh.worksheets()]
+    
+    if "Judgments" not in worksheet_titles:
+        sh.add_worksheet(title="Judgments", rows="1000", cols="10")
+    judgments_sheet = sh.worksheet("Judgments")
+    if not judgments_sheet.row_values(1):
+        judgments_sheet.append_row(["ID", "Case Name", "Act Name", "Section Number", "Authority", "Brief Facts", "Decision Held", "PDF File IDs", "AI Notes", "Status"], value_input_option="RAW", table_range="A1")
+        
+    if "Internal Usage" not in worksheet_titles:
+        sh.add_worksheet(title="Internal Usage", rows="1000", cols="10")
+    internal_sheet = sh.worksheet("Internal Usage")
+    if not internal_sheet.row_values(1):
+        internal_sheet.append_row(["ID", "Judgment ID", "Internal Matter Name", "Internal Notice", "Usage Notes", "AI Brief"], value_input_option="RAW", table_range="A1")
+        
+    if "Notice Replies" not in worksheet_titles:
+        sh.add_worksheet(title="Notice Replies", rows="1000", cols="10")
+    notice_sheet = sh.worksheet("Notice Replies")
+    if not notice_sheet.row_values(1):
+        notice_sheet.append_row(["ID", "Matter Name", "Notice Text", "Internal Judgments Used", "External References", "Final Reply"], value_input_option="RAW", table_range="A1")
+    try:
+        sentinel.upload_from_string("ok", content_type="text/plain")
+    except Exception:
+        # The sheets are verified; a missing sentinel only means the next cold start checks again
+        pass
+    return True
 
+@st.cache_resource
+def get_worksheets():
+    # One metadata fetch covers every tab; a missing sheet raises so the failure is not cached
+    by_title = {ws.title: ws for ws in sh.worksheets()}
+    return by_title["Judgments"], by_title["Notice Replies"]
+
+judgments_ws, replies_ws = None, None
 if sh:
-    init_sheets()
+    try:
+        ensure_schema(SHEET_ID)
+        judgments_ws, replies_ws = get_worksheets()
+    except Exception as e:
+        st.error(f"Error initializing sheets: {e}")
+
+# --- Cached Sheet Readers ---
+SHEET_RANGES = ["'Judgments'!A:J", "'Internal Usage'!A:F", "'Notice Replies'!A:F"]
+
+def _records_from_values(values):
+    if not values:
+        return []
+    header, rows = values[0], values[1:]
+    return [dict(zip(header, row + [""] * (len(header) - len(row)))) for row in rows]
+
+def _frame_from_values(values):
+    if not values:
+        return pd.DataFrame()
+    header, rows = values[0], values[1:]
+    width = len(header)
+    return pd.DataFrame([row[:width] + [""] * (width - len(row)) for row in rows], columns=header)
+
+def _build_good_law_catalog(df_j):
+    if df_j.empty or 'Status' not in df_j.columns:
+        return ""
+    good_law = df_j[df_j['Status'].str.contains('Good Law', na=False)]
+    return "\n\n".join(
+        f"ID: {r['ID']} | Case: {r['Case Name']} | Facts: {r['Brief Facts']} | Decision: {r['Decision Held']}"
+        for r in good_law.to_dict("records")
+    )
+
+def _build_dashboard_counts(df_j):
+    df_clean = df_j.replace('', pd.NA)
+    return {
+        col: df_clean[col].dropna().value_counts()
+        for col in ('Act Name', 'Authority', 'Status')
+        if col in df_clean.columns
+    }
+
+def _build_search_haystack(df_j):
+    if df_j.empty:
+        return pd.Series([], dtype=object)
+    fields = [df_j[col].fillna("") if col in df_j.columns else "" for col in ('Case Name', 'Brief Facts', 'Decision Held')]
+    # Newline separators keep a query from matching across field boundaries
+    return (fields[0] + "\n" + fields[1] + "\n" + fields[2]).str.lower()
+
+def _build_usage_indexes(internal_uses, replies, case_names):
+    # Lets each search-tab expander find its usage log with a dict lookup
+    uses_by_jid = defaultdict(list)
+    for use in internal_uses:
+        uses_by_jid[str(use.get('Judgment ID'))].append(use)
+    # Case names often contain commas, so cited names are matched against the known names
+    # rather than split out of the comma-joined column
+    known_names = {str(name) for name in case_names if name}
+    replies_by_case = defaultdict(list)
+    for rep in replies:
+        cited = str(rep.get('Internal Judgments Used', ''))
+        for name in known_names:
+            if name in cited:
+                replies_by_case[name].append(rep)
+    return dict(uses_by_jid), dict(replies_by_case)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_sheets():
+    value_ranges = sh.values_batch_get(SHEET_RANGES).get("valueRanges", [])
+    j_values, i_values, r_values = (vr.get("values", []) for vr in value_ranges)
+    # Judgments feed the pandas-based aggregates, so build that frame once and derive records from it
+    df_j = _frame_from_values(j_values)
+    judgments = df_j.to_dict("records")
+    internal_uses = _records_from_values(i_values)
+    replies = _records_from_values(r_values)
+    return {
+        "judgments": judgments,
+        "internal_uses": internal_uses,
+        "replies": replies,
+        "usage_indexes": _build_usage_indexes(internal_uses, replies, (r.get('Case Name') for r in judgments)),
+        # Sheet row numbers start at 2 because row 1 holds the header
+        "id_to_row_index": {str(r.get("ID")): i for i, r in enumerate(judgments, start=2)},
+        "good_law_catalog": _build_good_law_catalog(df_j),
+        "dashboard_counts": _build_dashboard_counts(df_j),
+        "search_haystack": _build_search_haystack(df_j),
+        "case_names": [r.get('Case Name') for r in judgments],
+        "case_name_set": frozenset(r.get('Case Name') for r in judgments),
+        "chat_judgments_by_name": {r['Case Name']: r for r in judgments if r.get("PDF File IDs")},
+    }
+
+# st.cache_data unpickles the whole bundle on every call, so each script run reads it once.
+# Streamlit executes app.py in a fresh module per run, so this never leaks across runs or sessions.
+_sheet_data = None
+
+def sheet_data():
+    global _sheet_data
+    if _sheet_data is None:
+        _sheet_data = load_sheets()
+    return _sheet_data
+
+def invalidate_sheets():
+    global _sheet_data
+    load_sheets.clear()
+    _sheet_data = None
+
+def load_judgments():
+    return sheet_data()["judgments"]
+
+def load_judgment_row_index():
+    return sheet_data()["id_to_row_index"]
+
+def load_good_law_catalog():
+    return sheet_data()["good_law_catalog"]
+
+def load_dashboard_counts():
+    return sheet_data()["dashboard_counts"]
+
+def load_case_names():
+    data = sheet_data()
+    return data["case_names"], data["case_name_set"]
+
+def load_chat_judgments():
+    return sheet_data()["chat_judgments_by_name"]
+
+def search_judgments(term):
+    data = sheet_data()
+    mask = data["search_haystack"].str.contains(term, regex=False, na=False)
+    return [data["judgments"][i] for i in np.flatnonzero(mask.to_numpy())]
+
+def load_usage_indexes():
+    return sheet_data()["usage_indexes"]
+
+def load_internal_usage():
+    return sheet_data()["internal_uses"]
+
+def load_replies():
+    return sheet_data()["replies"]
 
 # --- Google Cloud Storage File Handlers ---
-def upload_to_gcs(file_buffer, file_name):
+@st.cache_resource
+def get_gcs_bucket():
+    return storage_client.bucket(GCS_BUCKET_NAME)
+
+def upload_many_to_gcs(named_buffers):
+    # Returns (uploaded file names, error messages); safe to run off the script thread
+    try:
+        bucket = get_gcs_bucket()
+        # Callers pass fresh BytesIO views over the cached upload bytes, so no rewind is needed
+        pairs = [(file_buffer, bucket.blob(file_name)) for file_buffer, file_name in named_buffers]
+        results = transfer_manager.upload_many(
+            pairs,
+            upload_kwargs={"content_type": "application/pdf"},
+            max_workers=8,
+            worker_type=transfer_manager.THREAD,
+        )
+        uploaded, errors = [], []
+        for (_, file_name), result in zip(named_buffers, results):
+            if isinstance(result, Exception):
+                errors.append(f"GCS Upload Error: {result}")
+            else:
+                uploaded.append(file_name)
+        return uploaded, errors
+    except Exception as e:
+        return [], [f"GCS Upload Error: {e}"]
+
+def download_gcs_to_file(file_name, path):
     try:
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
+        bucket = get_gcs_bucket()
         blob = bucket.blob(file_name)
-        file_buffer.seek(0)
-        blob.upload_from_file(file_buffer, content_type='application/pdf')
-        return file_name
+        transfer_manager.download_chunks_concurrently(
+            blob, path,
+            chunk_size=4 * 1024 * 1024,
+            max_workers=8,
+            worker_type=transfer_manager.THREAD,
+        )
+        return path
     except Exception as e:
-        st.error(f"GCS Upload Error: {e}")
         return None
 
 def download_from_gcs(file_name):
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        if download_gcs_to_file(file_name, tmp.name):
+            tmp.seek(0)
+            return tmp.read()
+    return None
+
+def _attachment_disposition(download_name):
+    # Case names can hold quotes and non-ASCII dashes: send an ASCII-safe filename plus the RFC 5987 form
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', '_', download_name)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(download_name, safe='')}"
+
+def get_signed_url(file_name, download_name):
+    # Signed locally with the service-account key, so the browser fetches straight from GCS
     try:
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(file_name)
-        return blob.download_as_bytes()
+        blob = get_gcs_bucket().blob(file_name)
+        return blob.generate_signed_url(
+            version="v4",
+            expiration=timedelta(minutes=15),
+            method="GET",
+            response_disposition=_attachment_disposition(download_name),
+        )
     except Exception as e:
         return None
 
 # --- Helper Functions ---
-def extract_text_from_buffers(pdf_buffers):
-    text = ""
-    for pdf_buffer in pdf_buffers:
-        try:
-            pdf_buffer.seek(0)
-            reader = PyPDF2.PdfReader(pdf_buffer)
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + "\n"
-        except Exception:
-            pass
+def _pdf_source(pdf_buffer):
+    if isinstance(pdf_buffer, str):
+        return pdf_buffer
+    pdf_buffer.seek(0)
+    return pdf_buffer.read()
+
+PDF_POOL_WORKERS = min(4, len(os.sched_getaffinity(0)))
+
+@st.cache_resource
+def get_pdf_pool():
+    # One long-lived pool per server process. Workers are forked once, under the PDFium lock,
+    # so none inherits another session's half-finished parse. forkserver/spawn would re-run
+    # app.py in every worker, because Streamlit installs the script as __main__.
+    # Capped small: the workers are forked copies of the server that live as long as it does,
+    # and os.cpu_count() reports the host's CPUs inside a container
+    pool = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS, mp_context=multiprocessing.get_context("fork"))
+    with PDFIUM_LOCK:
+        # Fork-context pools start all of their workers on the first submit
+        pool.submit(int).result()
+    return pool
+
+def extract_texts(pdf_sources, max_chars=None, on_progress=None):
+    # Independent PDFs are parsed in the shared worker pool; a single PDF is parsed inline.
+    # on_progress(done, total) is called from the calling thread as each PDF finishes.
+    extract = partial(extract_pdf_text, max_chars=max_chars)
+    if len(pdf_sources) <= 1:
+        with PDFIUM_LOCK:
+            texts = [extract(source) for source in pdf_sources]
+        if on_progress and pdf_sources:
+            on_progress(1, 1)
+        return texts
+    texts = [None] * len(pdf_sources)
+    try:
+        futures = {get_pdf_pool().submit(extract, source): idx for idx, source in enumerate(pdf_sources)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            texts[futures[future]] = future.result()
+            if on_progress:
+                on_progress(done, len(pdf_sources))
+    except BrokenProcessPool:
+        # A crashed worker breaks the pool for good; rebuild it next time and finish inline
+        get_pdf_pool.clear()
+        with PDFIUM_LOCK:
+            texts = [extract(source) if text is None else text for text, source in zip(texts, pdf_sources)]
+    return texts
+
+def extract_text_from_buffers(pdf_buffers, max_chars=None):
+    # Accepts uploaded/in-memory buffers or file paths
+    texts = extract_texts([_pdf_source(b) for b in pdf_buffers], max_chars)
+    text = "\n".join(text for text in texts if text)
+    return text[:max_chars] if max_chars else text
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def load_judgment_text(file_ids):
+    # Follow-up questions on the same judgment skip the GCS fetch and PDF parse.
+    # Failures raise instead of returning, so they are not cached.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        targets = [os.path.join(tmpdir, f"{idx}.pdf") for idx in range(len(file_ids))]
+        with ThreadPoolExecutor(max_workers=min(8, len(file_ids) or 1)) as executor:
+            downloaded = list(executor.map(download_gcs_to_file, file_ids, targets))
+        if not all(downloaded):
+            raise RuntimeError("Could not download every attachment from Cloud Storage.")
+        text = extract_text_from_buffers(downloaded)
+    if not text:
+        raise ValueError("No text could be extracted from the attachments.")
     return text
 
-def ask_ai(prompt):
+@contextmanager
+def save_once(form_key, values):
+    # A second click reruns the script and interrupts the save already under way, so an
+    # in-script flag cannot block it; an identical resubmission is skipped instead
+    fingerprint = hash(values)
+    if st.session_state.last_saved.get(form_key) == fingerprint:
+        st.info("This submission has already been saved.")
+        yield False
+        return
+    st.session_state.last_saved[form_key] = fingerprint
+    try:
+        yield True
+    except Exception:
+        # Let the user retry a save that failed
+        st.session_state.last_saved.pop(form_key, None)
+        raise
+
+def get_cached_pdfs(uploaded_files):
+    # Keyed by (name, size) so a file is read and parsed once per session.
+    # Files removed from the uploader are dropped so their bytes are not held twice.
+    cache = st.session_state.pdf_cache
+    current_keys = [(f.name, f.size) for f in uploaded_files]
+    for key in set(cache) - set(current_keys):
+        del cache[key]
+    entries = []
+    for f, key in zip(uploaded_files, current_keys):
+        if key not in cache:
+            cache[key] = {"name": f.name, "bytes": f.getvalue(), "text": None}
+        entries.append(cache[key])
+    return entries
+
+@st.cache_resource
+def get_genai_client(key):
+    return genai.Client(api_key=key)
+
+# --- Structured AI Output Schemas ---
+class JudgmentDetails(BaseModel):
+    case_name: str
+    act_name: str
+    section_number: str
+    authority: str
+    brief_facts: str
+    decision_held: str
+    ai_notes: str
+
+class PrecedentSuggestions(BaseModel):
+    internal_cases: list[str]
+    external_suggestions: list[str]
+
+def _ai_config(schema=None, system_instruction=None):
+    if not schema and not system_instruction:
+        return None
+    config = types.GenerateContentConfig(system_instruction=system_instruction)
+    if schema:
+        config.response_mime_type = 'application/json'
+        config.response_schema = schema
+    return config
+
+def ask_ai(prompt, schema=None, system_instruction=None):
     if not api_key:
         return None, "Error: API Key is missing from Environment Variables."
     try:
-        client = genai.Client(api_key=api_key)
+        client = get_genai_client(api_key)
+        config = _ai_config(schema, system_instruction)
         response = client.models.generate_content(
             model='gemini-2.5-flash',
-            contents=prompt
+            contents=prompt,
+            config=config
         )
         return response.text, None
     except Exception as e:
         return None, f"AI Error: {e}"
 
+def stream_ai(prompt, system_instruction=None):
+    # Renders tokens as they arrive, then clears the preview and returns the full text
+    if not api_key:
+        return None, "Error: API Key is missing from Environment Variables."
+    try:
+        client = get_genai_client(api_key)
+        stream = client.models.generate_content_stream(
+            model='gemini-2.5-flash',
+            contents=prompt,
+            config=_ai_config(system_instruction=system_instruction)
+        )
+        preview = st.empty()
+        with preview.container():
+            text = st.write_stream(chunk.text for chunk in stream if chunk.text)
+        preview.empty()
+        return text, None
+    except Exception as e:
+        return None, f"AI Error: {e}"
+
+def notice_prompt(notice_text, task):
+    # Analysis and drafting both open with the same notice part (and LEGAL_SYSTEM_INSTRUCTION),
+    # so the second call shares the first call's prompt prefix for Gemini implicit caching
+    return [types.Content(role="user", parts=[
+        types.Part(text=f"Read this legal notice: {notice_text[:15000]}"),
+        types.Part(text=task),
+    ])]
+
+# --- Retrieval for Chat with PDF ---
+EMBED_MODEL = 'gemini-embedding-001'
+EMBED_BATCH_SIZE = 100
+
+def chunk_text(text, size=1000, overlap=200):
+    step = size - overlap
+    return [text[i:i + size] for i in range(0, max(len(text) - overlap, 1), step)]
+
+def _embed(texts, task_type):
+    client = get_genai_client(api_key)
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        response = client.models.embed_content(
+            model=EMBED_MODEL,
+            contents=texts[i:i + EMBED_BATCH_SIZE],
+            config=types.EmbedContentConfig(task_type=task_type)
+        )
+        vectors.extend(e.values for e in response.embeddings)
+    matrix = np.array(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+@st.cache_data(ttl=3600, max_entries=16, show_spinner=False)
+def embed_document(doc_text):
+    # Keyed by the text itself; a long judgment's vectors run to several MB, hence the small bound
+    chunks = chunk_text(doc_text)
+    return chunks, _embed(chunks, "RETRIEVAL_DOCUMENT")
+
+def retrieve_relevant_chunks(doc_text, question, top_k=8):
+    chunks, vectors = embed_document(doc_text)
+    query = _embed([question], "RETRIEVAL_QUERY")[0]
+    best = np.argsort(vectors @ query)[::-1][:top_k]
+    # Keep the passages in document order so the excerpt reads naturally
+    return [chunks[i] for i in sorted(best)]
+
+# --- Word Export ---
+# Fixed heading + body layout, so the package is rendered from string templates
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>'
+)
+DOCX_DOCUMENT = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+    '<w:p><w:r><w:rPr><w:b/><w:sz w:val="52"/></w:rPr><w:t xml:space="preserve">{{TITLE}}</w:t></w:r></w:p>'
+    '<w:p><w:r>{{BODY}}</w:r></w:p>'
+    '</w:body></w:document>'
+)
+_XML_INVALID_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _docx_text(text):
+    return xml_escape(_XML_INVALID_CHARS.sub('', str(text or '')))
+
 def create_word_docx(text, title="Legal Document"):
-    doc = Document()
-    doc.add_heading(title, 0)
-    doc.add_paragraph(text)
+    body = '<w:br/>'.join(
+        f'<w:t xml:space="preserve">{_docx_text(line)}</w:t>'
+        for line in str(text or '').split('\n')
+    )
+    document_xml = DOCX_DOCUMENT.replace('{{TITLE}}', _docx_text(title)).replace('{{BODY}}', body)
     bio = BytesIO()
-    doc.save(bio)
+    with zipfile.ZipFile(bio, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        z.writestr('_rels/.rels', DOCX_RELS)
+        z.writestr('word/document.xml', document_xml)
     return bio.getvalue()
 
 # --- Initialize Session State ---
@@ -137,6 +558,9 @@ if 'suggested_cases' not in st.session_state:
     st.session_state.suggested_cases = []
 if 'drafted_reply' not in st.session_state:
     st.session_state.drafted_reply = ""
+if 'pdf_cache' not in st.session_state:
+    st.session_state.pdf_cache = {}
+st.session_state.setdefault("last_saved", {})
 
 # --- UI Layout ---
 if not sh or not storage_client:
@@ -155,30 +579,33 @@ tab_dash, tab_search, tab_matters, tab_add, tab_reply, tab_chat = st.tabs([
 with tab_dash:
     st.header("Firm Analytics")
     try:
-        j_data = sh.worksheet("Judgments").get_all_records()
-        i_data = sh.worksheet("Internal Usage").get_all_records()
-        r_data = sh.worksheet("Notice Replies").get_all_records()
-        df_j = pd.DataFrame(j_data)
+        j_data = load_judgments()
+        i_data = load_internal_usage()
+        r_data = load_replies()
+        counts = load_dashboard_counts()
         
         col1, col2, col3 = st.columns(3)
         col1.metric("Total Judgments Banked", len(j_data))
         col2.metric("Quick Links", len(i_data))
         col3.metric("Drafted Notice Replies", len(r_data))
         
-        if not df_j.empty:
+        if j_data:
             st.markdown("---")
             c1, c2, c3 = st.columns(3)
             with c1:
-                if 'Act Name' in df_j.columns and not df_j['Act Name'].replace('', pd.NA).dropna().empty:
-                    fig1 = px.pie(df_j[df_j['Act Name'] != ''], names='Act Name', title='Judgments by Act', hole=0.4)
+                act_counts = counts.get('Act Name')
+                if act_counts is not None and not act_counts.empty:
+                    fig1 = px.pie(values=act_counts.values, names=act_counts.index, title='Judgments by Act', hole=0.4)
                     st.plotly_chart(fig1, use_container_width=True)
             with c2:
-                if 'Authority' in df_j.columns and not df_j['Authority'].replace('', pd.NA).dropna().empty:
-                    fig2 = px.histogram(df_j[df_j['Authority'] != ''], x='Authority', title='Judgments by Authority')
+                auth_counts = counts.get('Authority')
+                if auth_counts is not None and not auth_counts.empty:
+                    fig2 = px.bar(x=auth_counts.index, y=auth_counts.values, labels={'x': 'Authority', 'y': 'count'}, title='Judgments by Authority')
                     st.plotly_chart(fig2, use_container_width=True)
             with c3:
-                if 'Status' in df_j.columns:
-                    fig3 = px.pie(df_j, names='Status', title='Law Status Distribution')
+                status_counts = counts.get('Status')
+                if status_counts is not None:
+                    fig3 = px.pie(values=status_counts.values, names=status_counts.index, title='Law Status Distribution')
                     st.plotly_chart(fig3, use_container_width=True)
     except Exception as e:
         st.info("Dashboard will populate as data is added.")
@@ -190,27 +617,26 @@ with tab_search:
     st.header("Search, Edit, and Review Logs")
     search_term = st.text_input("Universal Search (Case Name, Facts, Decision):").lower()
     try:
-        judgments_sheet = sh.worksheet("Judgments")
-        judgments = judgments_sheet.get_all_records()
-        internal_uses = sh.worksheet("Internal Usage").get_all_records()
-        replies = sh.worksheet("Notice Replies").get_all_records()
+        judgments = load_judgments()
         
         results = []
         if search_term:
-            for row in judgments:
-                if (search_term in str(row.get('Case Name', '')).lower() or 
-                    search_term in str(row.get('Brief Facts', '')).lower() or 
-                    search_term in str(row.get('Decision Held', '')).lower()):
-                    results.append(row)
+            results = search_judgments(search_term)
         else:
             results = judgments
             
+        uses_by_jid, replies_by_case = load_usage_indexes()
+            
         if results:
-            st.success(f"Showing {len(results)} judgment(s).")
-            for row in results:
+            page_count = max(1, math.ceil(len(results) / SEARCH_PAGE_SIZE))
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1) if page_count > 1 else 1
+            page_start = (page - 1) * SEARCH_PAGE_SIZE
+            page_results = results[page_start:page_start + SEARCH_PAGE_SIZE]
+            st.success(f"Showing {page_start + 1}-{page_start + len(page_results)} of {len(results)} judgment(s).")
+            for row in page_results:
                 j_id = row.get("ID")
                 c_name = row.get("Case Name")
-                status = row.get("Status", "🟢 Good Law")
+                status = row.get("Status", STATUSES[0])
                 
                 with st.expander(f"{status} | {c_name} | {row.get('Act Name')} - Sec {row.get('Section Number')}"):
                     if "🛑" in status:
@@ -226,16 +652,14 @@ with tab_search:
                     use_count = 0
                     
                     # Check Quick Links
-                    for use in internal_uses:
-                        if str(use.get('Judgment ID')) == str(j_id):
-                            use_count += 1
-                            st.markdown(f"- **Linked Matter:** {use.get('Internal Matter Name')} | *Notes: {use.get('Usage Notes')}*")
+                    for use in uses_by_jid.get(str(j_id), []):
+                        use_count += 1
+                        st.markdown(f"- **Linked Matter:** {use.get('Internal Matter Name')} | *Notes: {use.get('Usage Notes')}*")
                     
                     # Check Replies
-                    for rep in replies:
-                        if c_name in str(rep.get('Internal Judgments Used', '')):
-                            use_count += 1
-                            st.markdown(f"- **Drafted Reply For:** {rep.get('Matter Name')}")
+                    for rep in replies_by_case.get(str(c_name), []):
+                        use_count += 1
+                        st.markdown(f"- **Drafted Reply For:** {rep.get('Matter Name')}")
                             
                     if use_count == 0:
                         st.caption("This judgment has not been cited in any internal matters yet.")
@@ -249,15 +673,18 @@ with tab_search:
                             e_act = st.text_input("Act Name", value=row.get('Act Name'))
                             e_sec = st.text_input("Section", value=row.get('Section Number'))
                             e_auth = st.text_input("Authority", value=row.get('Authority'))
-                            e_status = st.selectbox("Status", ["🟢 Good Law", "🟡 Distinguished / Caution", "🛑 Overruled / Bad Law"], index=["🟢 Good Law", "🟡 Distinguished / Caution", "🛑 Overruled / Bad Law"].index(status) if status in ["🟢 Good Law", "🟡 Distinguished / Caution", "🛑 Overruled / Bad Law"] else 0)
+                            e_status = st.selectbox("Status", STATUSES, index=STATUS_INDEX.get(status, 0))
                             e_facts = st.text_area("Brief Facts", value=row.get('Brief Facts'))
                             e_decision = st.text_area("Decision Held", value=row.get('Decision Held'))
                             
                             if st.form_submit_button("💾 Save Changes"):
                                 try:
-                                    cell = judgments_sheet.find(str(j_id))
+                                    if not judgments_ws:
+                                        raise RuntimeError("the Judgments sheet is unavailable")
+                                    row_idx = load_judgment_row_index()[str(j_id)]
                                     # Update cells in the specific row (Columns B through J, assuming A is ID)
-                                    judgments_sheet.update(f"B{cell.row}:J{cell.row}", [[e_c_name, e_act, e_sec, e_auth, e_facts, e_decision, row.get('PDF File IDs'), row.get('AI Notes'), e_status]])
+                                    judgments_ws.update([[e_c_name, e_act, e_sec, e_auth, e_facts, e_decision, row.get('PDF File IDs'), row.get('AI Notes'), e_status]], f"B{row_idx}:J{row_idx}")
+                                    invalidate_sheets()
                                     st.success("Judgment updated successfully! Please refresh to see changes.")
                                 except Exception as e:
                                     st.error(f"Error updating sheet: {e}")
@@ -268,9 +695,16 @@ with tab_search:
                         st.markdown("**Attachments:**")
                         for idx, fid in enumerate(file_ids):
                             if fid.strip():
-                                file_bytes = download_from_gcs(fid.strip())
-                                if file_bytes:
-                                    st.download_button(label=f"⬇️ Download PDF {idx+1}", data=file_bytes, file_name=f"{c_name}_Part{idx+1}.pdf", mime="application/pdf", key=f"dl_{fid}")
+                                signed_url = get_signed_url(fid.strip(), f"{c_name}_Part{idx+1}.pdf")
+                                if signed_url:
+                                    st.link_button(f"⬇️ Download PDF {idx+1}", signed_url)
+                                # Without a signing key, only fetch from GCS once the user asks for this file
+                                elif st.button(f"📎 Prepare PDF {idx+1}", key=f"prep_{fid}"):
+                                    file_bytes = download_from_gcs(fid.strip())
+                                    if file_bytes:
+                                        st.download_button(label=f"⬇️ Download PDF {idx+1}", data=file_bytes, file_name=f"{c_name}_Part{idx+1}.pdf", mime="application/pdf", key=f"dl_{fid}")
+                                    else:
+                                        st.error("Could not fetch this file from Cloud Storage.")
     except Exception as e:
         st.warning("Could not fetch records.")
 
@@ -282,12 +716,18 @@ with tab_matters:
     st.markdown("Review all active and historical matters your firm has logged.")
     
     try:
-        replies_data = sh.worksheet("Notice Replies").get_all_records()
-        links_data = sh.worksheet("Internal Usage").get_all_records()
+        replies_data = load_replies()
+        links_data = load_internal_usage()
         
         # Combine unique matter names
-        all_matters = list(set([r.get('Matter Name') for r in replies_data if r.get('Matter Name')] + 
-                               [l.get('Internal Matter Name') for l in links_data if l.get('Internal Matter Name')]))
+        matter_names = set()
+        for r in replies_data:
+            if r.get('Matter Name'):
+                matter_names.add(r.get('Matter Name'))
+        for l in links_data:
+            if l.get('Internal Matter Name'):
+                matter_names.add(l.get('Internal Matter Name'))
+        all_matters = list(matter_names)
         
         if all_matters:
             selected_matter = st.selectbox("Select a Matter / Client to Review:", ["-- Select --"] + sorted(all_matters))
@@ -308,8 +748,9 @@ with tab_matters:
                             st.markdown("**Final Reply:**")
                             st.info(rep.get('Final Reply'))
                             
-                            docx_file = create_word_docx(rep.get('Final Reply'), f"Reply - {selected_matter}")
-                            st.download_button("📄 Download Reply as Word", data=docx_file, file_name=f"Reply_{selected_matter}.docx", key=f"dl_rep_{rep.get('ID')}")
+                            if st.button("📄 Prepare Word File", key=f"prep_rep_{rep.get('ID')}"):
+                                docx_file = create_word_docx(rep.get('Final Reply'), f"Reply - {selected_matter}")
+                                st.download_button("📄 Download Reply as Word", data=docx_file, file_name=f"Reply_{selected_matter}.docx", key=f"dl_rep_{rep.get('ID')}")
                 
                 # Show Quick Links for this matter
                 matter_links = [l for l in links_data if l.get('Internal Matter Name') == selected_matter]
@@ -334,12 +775,23 @@ with tab_add:
     if st.button("🤖 AI: Read PDFs & Auto-Fill"):
         if uploaded_files:
             with st.spinner("Extracting details..."):
-                pdf_text = extract_text_from_buffers(uploaded_files)
-                prompt = f"""Extract details from this judgment into JSON format ONLY with keys: "case_name", "act_name", "section_number", "authority", "brief_facts", "decision_held", "ai_notes". Text: {pdf_text[:30000]}"""
-                res, err = ask_ai(prompt)
+                pdf_entries = get_cached_pdfs(uploaded_files)
+                pending = [entry for entry in pdf_entries if entry["text"] is None]
+                if pending:
+                    progress = st.progress(0.0, text="Reading PDFs...")
+                    texts = extract_texts(
+                        [entry["bytes"] for entry in pending], max_chars=30000,
+                        on_progress=lambda done, total: progress.progress(done / total, text=f"Read {done} of {total} PDF(s)")
+                    )
+                    progress.empty()
+                    for entry, text in zip(pending, texts):
+                        entry["text"] = text
+                pdf_text = "\n".join(entry["text"] for entry in pdf_entries if entry["text"])
+                prompt = f"""Extract the case details from this judgment. Text: {pdf_text[:30000]}"""
+                res, err = ask_ai(prompt, schema=JudgmentDetails)
                 if not err:
                     try:
-                        data = json.loads(res.replace("```json", "").replace("```", "").strip())
+                        data = json.loads(res)
                         for key in st.session_state.form_data.keys():
                             st.session_state.form_data[key] = data.get(key, "")
                         st.success("Auto-filled below!")
@@ -358,27 +810,41 @@ with tab_add:
             section_num = st.text_input("Section Number", value=st.session_state.form_data["section_number"])
             authority = st.text_input("Authority", value=st.session_state.form_data["authority"])
         with c3:
-            status = st.selectbox("Current Status", ["🟢 Good Law", "🟡 Distinguished / Caution", "🛑 Overruled / Bad Law"])
+            status = st.selectbox("Current Status", STATUSES)
             
         brief_facts = st.text_area("Brief Facts *", value=st.session_state.form_data["brief_facts"])
         decision_held = st.text_area("Decision Held *", value=st.session_state.form_data["decision_held"])
         ai_notes = st.text_area("AI Notes", value=st.session_state.form_data["ai_notes"])
         
         if st.form_submit_button("✅ Upload & Save to Cloud"):
-            if case_name and brief_facts and decision_held:
-                with st.spinner("Uploading to Google Cloud Storage and saving to Sheets..."):
-                    j_id = str(int(time.time()))
-                    gcs_file_ids = []
-                    if uploaded_files:
-                        for f in uploaded_files:
-                            file_buffer = BytesIO(f.getbuffer())
-                            fid = upload_to_gcs(file_buffer, f"{j_id}_{f.name}")
-                            if fid: gcs_file_ids.append(fid)
+            if not judgments_ws:
+                st.error("The Judgments sheet is unavailable. Please try again later.")
+            elif case_name and brief_facts and decision_held:
+                submission = (case_name, act_name, section_num, authority, status, brief_facts, decision_held, ai_notes,
+                              tuple((f.name, f.size) for f in uploaded_files or []))
+                with save_once("add_judgment", submission) as acquired:
+                    if acquired:
+                        with st.spinner("Uploading to Google Cloud Storage and saving to Sheets..."):
+                            j_id = uuid.uuid4().hex
+                            named_buffers = [(BytesIO(entry["bytes"]), f"{j_id}_{entry['name']}") for entry in get_cached_pdfs(uploaded_files or [])]
+                            expected_ids = [file_name for _, file_name in named_buffers]
                     
-                    row_data = [j_id, case_name, act_name, section_num, authority, brief_facts, decision_held, ",".join(gcs_file_ids), ai_notes, status]
-                    sh.worksheet("Judgments").append_row(row_data)
-                    st.session_state.form_data = {k: "" for k in st.session_state.form_data}
-                    st.success("Saved successfully to the Cloud!")
+                            # Blob names are known up front, so the sheet append runs while the PDFs upload
+                            row_data = [j_id, case_name, act_name, section_num, authority, brief_facts, decision_held, ",".join(expected_ids), ai_notes, status]
+                            with ThreadPoolExecutor(max_workers=1) as executor:
+                                upload_future = executor.submit(upload_many_to_gcs, named_buffers)
+                                append_res = judgments_ws.append_rows([row_data], value_input_option="RAW", insert_data_option="INSERT_ROWS", table_range="A1")
+                                gcs_file_ids, upload_errors = upload_future.result()
+                            for msg in upload_errors:
+                                st.error(msg)
+                            if gcs_file_ids != expected_ids:
+                                # Drop references to files that failed to upload
+                                updated_row = re.search(r"(\d+):", append_res["updates"]["updatedRange"]).group(1)
+                                judgments_ws.update([[",".join(gcs_file_ids)]], f"H{updated_row}", value_input_option="RAW")
+                            invalidate_sheets()
+                            st.session_state.form_data = {k: "" for k in st.session_state.form_data}
+                            st.session_state.pdf_cache = {}
+                            st.success("Saved successfully to the Cloud!")
 
 # ==========================================
 # TAB 5: DRAFT NOTICE REPLY
@@ -391,31 +857,22 @@ with tab_reply:
         if notice_files:
             with st.spinner("Reading Notice and searching RBS Knowledge Corner..."):
                 st.session_state.notice_text = extract_text_from_buffers(notice_files)
+                good_law_catalog = load_good_law_catalog()
                 
-                all_judgments = sh.worksheet("Judgments").get_all_records()
-                good_law_catalog = ""
-                for j in all_judgments:
-                    if "Good Law" in j.get("Status", ""):
-                        good_law_catalog += f"ID: {j['ID']} | Case: {j['Case Name']} | Facts: {j['Brief Facts']} | Decision: {j['Decision Held']}\n\n"
-                
-                prompt = f"""
-                You are a senior litigation attorney. 
-                Read this legal notice: {st.session_state.notice_text[:15000]}
-                
+                task_prompt = f"""
                 Task 1: Identify the best internal precedents from this catalog:
                 {good_law_catalog[:30000]}
                 
                 Task 2: Suggest 2 or 3 major EXTERNAL landmark legal precedents (not in the catalog) that are highly relevant to defending against this notice.
                 
-                Return ONLY a valid JSON object with two keys:
-                "internal_cases": [list of exact Case Names from the catalog]
-                "external_suggestions": [list of external case names and a 1-sentence explanation of why]
+                Put exact Case Names from the catalog in "internal_cases", and each external case name with a 1-sentence explanation of why in "external_suggestions".
                 """
-                res, err = ask_ai(prompt)
+                prompt = notice_prompt(st.session_state.notice_text, task_prompt)
+                res, err = ask_ai(prompt, schema=PrecedentSuggestions, system_instruction=LEGAL_SYSTEM_INSTRUCTION)
                 
                 if not err:
                     try:
-                        suggestions = json.loads(res.replace("```json", "").replace("```", "").strip())
+                        suggestions = json.loads(res)
                         st.session_state.suggested_cases = suggestions.get("internal_cases", [])
                         st.success("Analysis complete!")
                         if suggestions.get("external_suggestions"):
@@ -429,9 +886,9 @@ with tab_reply:
     st.header("📝 Step 2: Build Your Argument")
     
     try:
-        all_judgments = sh.worksheet("Judgments").get_all_records()
-        all_case_names = [j['Case Name'] for j in all_judgments]
-        default_selections = [c for c in st.session_state.suggested_cases if c in all_case_names]
+        all_judgments = load_judgments()
+        all_case_names, known_case_names = load_case_names()
+        default_selections = [c for c in st.session_state.suggested_cases if c in known_case_names]
         
         selected_internal = st.multiselect("Select RBS Precedents to include:", options=all_case_names, default=default_selections)
         
@@ -441,16 +898,14 @@ with tab_reply:
         if st.button("✍️ Draft Reply"):
             if st.session_state.notice_text:
                 with st.spinner("Drafting your response..."):
-                    selected_details = ""
-                    for j in all_judgments:
-                        if j['Case Name'] in selected_internal:
-                            selected_details += f"Case: {j['Case Name']}\nRuling: {j['Decision Held']}\n\n"
+                    selected_set = set(selected_internal)
+                    selected_details = "\n\n".join(
+                        f"Case: {j['Case Name']}\nRuling: {j['Decision Held']}"
+                        for j in all_judgments if j['Case Name'] in selected_set
+                    )
                     
-                    draft_prompt = f"""
-                    You are an expert legal counsel. Draft a formal, professional legal reply to the following notice.
-                    
-                    Original Notice received:
-                    {st.session_state.notice_text[:15000]}
+                    draft_task = f"""
+                    Draft a formal, professional legal reply to the notice above.
                     
                     You MUST cite and apply these internal precedents to support our position:
                     {selected_details}
@@ -460,8 +915,9 @@ with tab_reply:
                     
                     Draft the full body of the legal reply. Use standard legal formatting and authoritative tone. Do not use placeholders for dates/names if you can deduce them.
                     """
+                    draft_prompt = notice_prompt(st.session_state.notice_text, draft_task)
                     
-                    draft_res, err = ask_ai(draft_prompt)
+                    draft_res, err = stream_ai(draft_prompt, system_instruction=LEGAL_SYSTEM_INSTRUCTION)
                     if not err:
                         st.session_state.drafted_reply = draft_res
             else:
@@ -479,19 +935,25 @@ with tab_reply:
     col1, col2 = st.columns(2)
     with col1:
         if st.button("💾 Save to RBS Knowledge Corner"):
-            if matter_name and final_draft:
-                with st.spinner("Saving to Google Sheets..."):
-                    record_id = str(int(time.time()))
-                    row_data = [
-                        record_id, 
-                        matter_name, 
-                        st.session_state.notice_text, 
-                        ", ".join(selected_internal), 
-                        external_refs, 
-                        final_draft
-                    ]
-                    sh.worksheet("Notice Replies").append_row(row_data)
-                    st.success("Notice and Reply successfully recorded! You can view it in the 'Internal Matters' tab.")
+            if not replies_ws:
+                st.error("The Notice Replies sheet is unavailable. Please try again later.")
+            elif matter_name and final_draft:
+                submission = (matter_name, st.session_state.notice_text, tuple(selected_internal), external_refs, final_draft)
+                with save_once("notice_reply", submission) as acquired:
+                    if acquired:
+                        with st.spinner("Saving to Google Sheets..."):
+                            record_id = uuid.uuid4().hex
+                            row_data = [
+                                record_id, 
+                                matter_name, 
+                                st.session_state.notice_text, 
+                                ", ".join(selected_internal), 
+                                external_refs, 
+                                final_draft
+                            ]
+                            replies_ws.append_rows([row_data], value_input_option="RAW", insert_data_option="INSERT_ROWS", table_range="A1")
+                            invalidate_sheets()
+                            st.success("Notice and Reply successfully recorded! You can view it in the 'Internal Matters' tab.")
             else:
                 st.error("Please provide a Matter Name and ensure the draft is not empty.")
     
@@ -506,9 +968,8 @@ with tab_reply:
 with tab_chat:
     st.header("💬 Interactive Q&A with Judgments")
     try:
-        chat_judgments = [row for row in sh.worksheet("Judgments").get_all_records() if row.get("PDF File IDs")]
-        if chat_judgments:
-            c_dict = {r['Case Name']: r for r in chat_judgments}
+        c_dict = load_chat_judgments()
+        if c_dict:
             selected_chat_j = st.selectbox("Select a Judgment to Chat with:", options=list(c_dict.keys()))
             
             user_question = st.text_input("Ask a question about this specific judgment:")
@@ -516,18 +977,18 @@ with tab_chat:
                 if user_question:
                     with st.spinner("Fetching PDF from Cloud Storage and analyzing..."):
                         file_ids = str(c_dict[selected_chat_j]["PDF File IDs"]).split(",")
-                        doc_text = ""
-                        for fid in file_ids:
-                            if fid.strip():
-                                pdf_bytes = download_from_gcs(fid.strip())
-                                if pdf_bytes:
-                                    reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
-                                    for page in reader.pages:
-                                        doc_text += page.extract_text() + "\n"
+                        try:
+                            doc_text = load_judgment_text(tuple(fid.strip() for fid in file_ids if fid.strip()))
+                        except Exception:
+                            doc_text = ""
                         
                         if doc_text:
-                            prompt = f"Based ONLY on the following legal judgment text, answer this question: {user_question}\n\nJudgment Text:\n{doc_text[:35000]}"
-                            answer, err = ask_ai(prompt)
+                            try:
+                                context = "\n---\n".join(retrieve_relevant_chunks(doc_text, user_question))
+                            except Exception:
+                                context = doc_text[:35000]
+                            prompt = f"Based ONLY on the following legal judgment text, answer this question: {user_question}\n\nJudgment Text:\n{context}"
+                            answer, err = stream_ai(prompt)
                             if not err:
                                 st.session_state.chat_history.append({"q": user_question, "a": answer})
                         else:
@@ -0,0 +1,29 @@
+import threading
+import pypdfium2 as pdfium
+
+# Lives outside app.py so ProcessPoolExecutor workers can import it;
+# Streamlit runs app.py as a synthetic __main__ that child processes cannot resolve.
+
+# PDFium is not thread-safe. app.py is re-executed in a fresh module on every run, so the lock
+# lives here, where it is created once per server process and shared by every session.
+# Callers hold it around in-process parses; pool workers run single-threaded and do not.
+PDFIUM_LOCK = threading.Lock()
+
+def extract_pdf_text(source, max_chars=None):
+    # source is raw PDF bytes or a file path; paths are read by PDFium directly from disk.
+    # Stops at max_chars so pages past the prompt budget are never parsed.
+    parts = []
+    total = 0
+    try:
+        pdf = pdfium.PdfDocument(source)
+        for page in pdf:
+            extracted = page.get_textpage().get_text_bounded()
+            if extracted:
+                parts.append(extracted)
+                total += len(extracted) + 1
+                if max_chars and total >= max_chars:
+                    break
+    except Exception:
+        pass
+    text = "\n".join(parts)
+    return text[:max_chars] if max_chars else text